@@ -1,20 +1,71 @@
 import streamlit as st
+import atexit
+import contextlib
+import gzip
 import json
+import logging
 import os
+import re
+import sys
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import markdown
 from laboratory import AgentLaboratory
 from pathlib import Path
 
-# Set page config
-st.set_page_config(
-    page_title="Dirk's Agent Laboratory Research Lab",
-    page_icon="🧪",
-    layout="wide"
-)
+try:
+    import orjson
+except ImportError:
+    # Fall back to the standard library encoder if orjson is not installed
+    orjson = None
 
-# Custom CSS for styling
-st.markdown("""
+# Log to stderr, which Streamlit Cloud captures. The script reruns on every
+# interaction, so only attach the handler once.
+logger = logging.getLogger(__name__)
+if not logger.handlers:
+    _log_handler = logging.StreamHandler(sys.stderr)
+    _log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    logger.addHandler(_log_handler)
+    logger.setLevel(logging.INFO)
+
+# Topics of all research projects, one {research_id: topic} object per line
+INDEX_FILE = "research_index.jsonl"
+
+# Directory holding one gzipped JSON file with the full record per project
+RESULTS_DIR = "results"
+
+# Results file written by earlier versions of the app; it is moved into the
+# index and results directory once, then renamed to "<name>.migrated"
+LEGACY_RESULTS_FILE = "research_results.json"
+
+# Buffer size for reading and writing result files
+IO_BUFFER_SIZE = 64 * 1024
+
+# Fastest gzip level; JSON text still compresses well at this setting
+GZIP_LEVEL = 1
+
+# Maximum number of full research records kept in memory; the rest stay on
+# disk and are read back when selected
+MAX_IN_MEMORY = 50
+
+# Markers that indicate a string value already contains markdown
+# ('#' also covers '##' and '###')
+_MD_MARKER_RE = re.compile(r"[#-]|\*\*")
+
+# Separator between focus areas, including the whitespace around the comma
+_FOCUS_AREA_SEP_RE = re.compile(r"\s*,\s*")
+
+# Turns a topic into a file name: spaces become underscores and characters
+# that are not allowed in file names are dropped
+_SLUG_TABLE = str.maketrans({" ": "_", **{c: None for c in '<>:"/\\|?*'}})
+
+# Turns a research id into a file name that is valid on every platform
+_RESULT_NAME_TABLE = str.maketrans({" ": "_", ":": "-"})
+
+# Static HTML, built once instead of on every rerun
+_CSS_HTML = """
     <style>
     .header-container {
         display: flex;
@@ -40,45 +91,319 @@ st.markdown("""
         text-decoration: underline;
     }
     </style>
-""", unsafe_allow_html=True)
+"""
+
+_HEADER_HTML = """
+    <div class="header-container">
+        <div style="flex: 1">
+            <h1>Dirk's Agent Laboratory Research Lab</h1>
+            <p style="color: #666;">
+                Advanced Research Assistant by 
+                <a href="https://ai-engineering.ai" target="_blank" style="color: #0066cc; text-decoration: none;">AI Engineering</a>
+            </p>
+        </div>
+    </div>
+"""
+
+_COMPANY_INFO_HTML = """
+    <div class="company-info">
+        <p><strong>AI Engineering</strong></p>
+        <p>Author: Dirk Wonhoefer<br>
+        Email: <a href="mailto:dirk.wonhoefer@ai-engineering.ai">dirk.wonhoefer@ai-engineering.ai</a><br>
+        Website: <a href="https://ai-engineering.ai" target="_blank">ai-engineering.ai</a></p>
+    </div>
+"""
+
+_FOOTER_HTML = """
+    <div class="company-info" style="text-align: center;">
+        <p>© 2024 AI Engineering. All rights reserved.</p>
+        <p>
+            <a href="https://ai-engineering.ai" target="_blank">Visit our website</a> | 
+            <a href="mailto:dirk.wonhoefer@ai-engineering.ai">Contact us</a>
+        </p>
+    </div>
+"""
+
+# Set page config
+st.set_page_config(
+    page_title="Dirk's Agent Laboratory Research Lab",
+    page_icon="🧪",
+    layout="wide"
+)
+
+# Custom CSS for styling
+st.markdown(_CSS_HTML, unsafe_allow_html=True)
+
+def _dumps(obj):
+    """Serialize an object to single-line JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj).encode("utf-8")
+
+def _loads(data):
+    """Deserialize JSON bytes"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def _new_research_id():
+    """Key for a new research project: the current time plus a random suffix
+
+    The suffix keeps keys unique when sessions finish in the same second.
+    """
+    return f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} {uuid.uuid4().hex[:8]}"
+
+def _result_path(research_id):
+    """Path of the file holding the full record of a research project"""
+    return Path(RESULTS_DIR) / f"{research_id.translate(_RESULT_NAME_TABLE)}.json.gz"
+
+def _iter_index():
+    """Yield (research_id, topic) pairs from the index file in order"""
+    with open(INDEX_FILE, "rb", buffering=IO_BUFFER_SIZE) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                entry = _loads(line)
+            except ValueError:
+                # Skip a line that was only partially written
+                continue
+            yield from entry.items()
+
+@st.cache_data(show_spinner=False, max_entries=1)
+def _load_index(mtime):
+    """Load the topics of all research projects from the index file
+
+    The file's modification time is passed in as the cache key, so the file
+    is only parsed again after a new project has been added. Only the
+    latest version is kept; older ones are stale once the file changes.
+    """
+    index = {}
+    try:
+        for research_id, topic in _iter_index():
+            index[research_id] = topic
+    except OSError as e:
+        # If there's an error reading the file, start with empty results
+        logger.warning("Could not load research index: %s", e)
+    return index
+
+@st.cache_data(show_spinner=False, max_entries=MAX_IN_MEMORY)
+def _load_one(research_id):
+    """Read the full record of a single research project"""
+    with open(_result_path(research_id), "rb", buffering=IO_BUFFER_SIZE) as raw, \
+            gzip.GzipFile(fileobj=raw, mode="rb") as f:
+        return _loads(f.read())
+
+def _write_atomic(path, data):
+    """Write bytes to a file so readers only ever see the complete contents"""
+    tmp = f"{path}.tmp"
+    try:
+        with open(tmp, "wb", buffering=IO_BUFFER_SIZE) as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except OSError:
+        # Don't leave a half-written temporary file behind
+        with contextlib.suppress(OSError):
+            os.remove(tmp)
+        raise
+
+def save_result(research_id, record, indexed=False):
+    """Write a research record to its own file and add it to the index
+
+    Pass ``indexed=True`` if the index already lists ``research_id``.
+    Returns whether the record was saved.
+    """
+    try:
+        data = gzip.compress(_dumps(record), compresslevel=GZIP_LEVEL)
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        _write_atomic(_result_path(research_id), data)
+        if indexed:
+            return True
+        # Only index the record once its file is safely on disk
+        line = _dumps({research_id: record["topic"]}) + b"\n"
+        with open(INDEX_FILE, "a+b", buffering=IO_BUFFER_SIZE) as f:
+            # Start on a new line if an earlier append was cut short, so the
+            # torn fragment is skipped on load instead of corrupting this entry
+            end = f.seek(0, os.SEEK_END)
+            if end:
+                f.seek(end - 1)
+                if f.read(1) != b"\n":
+                    line = b"\n" + line
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        return True
+    except (OSError, TypeError, ValueError) as e:
+        # If we can't save to file (e.g., on Streamlit Cloud), just keep results in memory
+        logger.warning("Could not save research results for %s: %s", research_id, e)
+        return False
+
+@st.cache_resource(show_spinner=False)
+def _migrate_legacy_results():
+    """Move results saved by earlier versions of the app into the current layout
+
+    Runs once per server process, before any session reads the index.
+    Records keep their original timestamp as their id, so if a previous
+    attempt was interrupted, running it again overwrites the same files
+    instead of adding duplicates.
+
+    Returns the records that could not be saved (e.g., on a read-only disk),
+    so they can still be shown read-only as before. Sessions share the
+    returned dict and must not modify it.
+    """
+    if not os.path.exists(LEGACY_RESULTS_FILE):
+        return {}
+    try:
+        with open(LEGACY_RESULTS_FILE, "rb", buffering=IO_BUFFER_SIZE) as f:
+            legacy = _loads(f.read())
+    except (OSError, ValueError) as e:
+        logger.warning("Could not read %s: %s", LEGACY_RESULTS_FILE, e)
+        return {}
+    indexed = set()
+    try:
+        indexed.update(research_id for research_id, _ in _iter_index())
+    except OSError:
+        # No index yet
+        pass
+    unsaved = {
+        timestamp: record for timestamp, record in legacy.items()
+        if not save_result(timestamp, record, indexed=timestamp in indexed)
+    }
+    if unsaved:
+        # Leave the file in place so nothing is lost
+        logger.warning("Could not migrate %s; keeping it in place", LEGACY_RESULTS_FILE)
+        return unsaved
+    try:
+        os.replace(LEGACY_RESULTS_FILE, f"{LEGACY_RESULTS_FILE}.migrated")
+    except OSError as e:
+        logger.warning("Could not rename %s after migrating it: %s", LEGACY_RESULTS_FILE, e)
+    return {}
 
 # Initialize session state variables if they don't exist
 if 'research_results' not in st.session_state:
-    st.session_state.research_results = {}
+    # Topics of all research projects, and the full records of the ones
+    # created in this session along with the Future of their save
+    st.session_state.research_index = {}
+    st.session_state.research_results = OrderedDict()
     # Load existing results if available
-    results_file = Path("research_results.json")
-    if results_file.exists():
-        try:
-            with open(results_file, "r") as f:
-                st.session_state.research_results = json.load(f)
-        except:
-            # If there's an error reading the file, start with empty results
-            pass
+    unmigrated = _migrate_legacy_results()
+    index_file = Path(INDEX_FILE)
+    if index_file.exists():
+        st.session_state.research_index = _load_index(index_file.stat().st_mtime)
+    # List legacy records that could not be migrated as well
+    for research_id, record in unmigrated.items():
+        st.session_state.research_index.setdefault(research_id, record["topic"])
 
 if 'api_key' not in st.session_state:
     st.session_state.api_key = None
 
-def save_results():
-    """Save research results to JSON file"""
+
+def _is_saved(future):
+    """Whether a background save has finished and written the record to disk"""
+    return future.done() and future.exception() is None and future.result()
+
+def _remember_result(research_id, record, saving):
+    """Keep a research record in session state, evicting the least recently used
+
+    ``saving`` is the Future of the record's background save. Only records
+    that are safely on disk are evicted; the others are this session's only
+    copy and stay in memory even past MAX_IN_MEMORY.
+    """
+    results = st.session_state.research_results
+    results[research_id] = (record, saving)
+    results.move_to_end(research_id)
+    excess = len(results) - MAX_IN_MEMORY
+    if excess > 0:
+        evictable = [key for key, (_, future) in results.items() if _is_saved(future)]
+        for key in evictable[:excess]:
+            del results[key]
+
+def _get_result(research_id):
+    """Return a research record, reading it from disk if it is not in session state"""
+    results = st.session_state.research_results
+    if research_id in results:
+        results.move_to_end(research_id)
+        return results[research_id][0]
+    # Legacy records that could not be migrated are only held in memory
+    unmigrated = _migrate_legacy_results()
+    if research_id in unmigrated:
+        return unmigrated[research_id]
     try:
-        with open("research_results.json", "w") as f:
-            json.dump(st.session_state.research_results, f, indent=4)
-    except:
-        # If we can't save to file (e.g., on Streamlit Cloud), just keep results in memory
-        pass
+        return _load_one(research_id)
+    except (OSError, EOFError, ValueError) as e:
+        # The record's file is missing or unreadable
+        logger.warning("Could not load research results for %s: %s", research_id, e)
+        return None
+
+@st.cache_resource(show_spinner=False)
+def _get_io_pool():
+    """Create the background thread shared by all sessions for saving results"""
+    # A single worker keeps writes from different sessions in order
+    pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="results-io")
+    # Flush pending writes before the server exits
+    atexit.register(pool.shutdown, wait=True)
+    return pool
+
+def _get_lab(api_key, model_name):
+    """Return this session's laboratory, creating it when the key or model changes
+
+    The laboratory keeps each run's state on the instance, so it lives in
+    session state rather than in a process-wide cache shared between sessions.
+    """
+    if st.session_state.get("lab_key") != (api_key, model_name):
+        st.session_state.lab = AgentLaboratory(api_key=api_key, model_name=model_name)
+        st.session_state.lab_key = (api_key, model_name)
+    return st.session_state.lab
+
+def _walk_markdown(d, level, out):
+    """Append the Markdown for a nested value to ``out``"""
+    indent = "  " * level
+    
+    if isinstance(d, dict):
+        for key, value in d.items():
+            if isinstance(value, (dict, list)):
+                out.append(f"{indent}### {key}\n\n")
+                _walk_markdown(value, level + 1, out)
+            else:
+                # Check if value is a string containing markdown
+                if isinstance(value, str) and _MD_MARKER_RE.search(value) is not None:
+                    out.append(f"{indent}### {key}\n\n{value}\n\n")
+                else:
+                    out.append(f"{indent}### {key}\n\n```\n{value}\n```\n\n")
+    elif isinstance(d, list):
+        for item in d:
+            if isinstance(item, (dict, list)):
+                _walk_markdown(item, level, out)
+            else:
+                out.append(f"{indent}- {item}\n")
+        out.append("\n")
+    else:
+        out.append(f"{indent}{d}\n\n")
+
+def dict_to_markdown(d):
+    """Convert nested research results to Markdown"""
+    out = []
+    _walk_markdown(d, 0, out)
+    return "".join(out)
+
+@st.cache_data(show_spinner=False, max_entries=MAX_IN_MEMORY)
+def _export_markdown(research_id, _research):
+    """Build the Markdown export for a research record
+
+    Results are cached per research id; the leading underscore keeps the
+    record itself out of the cache key so it is not hashed on every rerun.
+    """
+    return "".join([
+        f"# Research Results: {_research['topic']}\n\n",
+        f"## Focus Areas\n{_research['focus_areas']}\n\n",
+        "## Results\n\n",
+        dict_to_markdown(_research['results']),
+    ])
 
 # Header with corporate identity
-st.markdown("""
-    <div class="header-container">
-        <div style="flex: 1">
-            <h1>Dirk's Agent Laboratory Research Lab</h1>
-            <p style="color: #666;">
-                Advanced Research Assistant by 
-                <a href="https://ai-engineering.ai" target="_blank" style="color: #0066cc; text-decoration: none;">AI Engineering</a>
-            </p>
-        </div>
-    </div>
-""", unsafe_allow_html=True)
+st.markdown(_HEADER_HTML, unsafe_allow_html=True)
 
 # Sidebar for API key and controls
 with st.sidebar:
@@ -99,25 +424,29 @@ with st.sidebar:
     # New Research button
     if st.button("New Research", type="primary"):
         st.session_state.current_view = "new_research"
+        # Clear the selection so any project can be picked again below
+        st.session_state.pop("selected_research", None)
     
-    # List of existing research projects
-    if st.session_state.research_results:
+    # List of existing research projects in a single widget, however many there are
+    if st.session_state.research_index:
         st.subheader("Previous Research")
-        for timestamp, research in st.session_state.research_results.items():
-            if st.button(f"📑 {research['topic']}", key=timestamp):
-                st.session_state.current_view = "view_research"
-                st.session_state.selected_research = timestamp
+        options = list(st.session_state.research_index)
+        current = st.session_state.get("selected_research")
+        selected = st.selectbox(
+            "Previous Research",
+            options=options,
+            index=options.index(current) if current in options else None,
+            format_func=lambda research_id: f"📑 {st.session_state.research_index[research_id]}",
+            placeholder="Select a research project",
+            label_visibility="collapsed"
+        )
+        if selected is not None and selected != current:
+            st.session_state.current_view = "view_research"
+            st.session_state.selected_research = selected
     
     # Add company info in sidebar footer
     st.sidebar.markdown("---")
-    st.sidebar.markdown("""
-        <div class="company-info">
-            <p><strong>AI Engineering</strong></p>
-            <p>Author: Dirk Wonhoefer<br>
-            Email: <a href="mailto:dirk.wonhoefer@ai-engineering.ai">dirk.wonhoefer@ai-engineering.ai</a><br>
-            Website: <a href="https://ai-engineering.ai" target="_blank">ai-engineering.ai</a></p>
-        </div>
-    """, unsafe_allow_html=True)
+    st.sidebar.markdown(_COMPANY_INFO_HTML, unsafe_allow_html=True)
 
 # Main content area
 def conduct_research(topic, focus_areas):
@@ -127,11 +456,11 @@ def conduct_research(topic, focus_areas):
         return False, "API key required"
     
     try:
-        # Initialize the laboratory with the API key
-        lab = AgentLaboratory(api_key=st.session_state.api_key, model_name="gpt-4o")
+        # Get the laboratory for this API key
+        lab = _get_lab(st.session_state.api_key, "gpt-4o")
         
         task_notes = {
-            "focus_areas": [area.strip() for area in focus_areas.split(",")],
+            "focus_areas": list(filter(None, _FOCUS_AREA_SEP_RE.split(focus_areas.strip()))),
             "experiment_preferences": {
                 "dataset_size": "small",
                 "model_complexity": "medium",
@@ -143,17 +472,20 @@ def conduct_research(topic, focus_areas):
             results = lab.conduct_research(topic, task_notes)
             
         # Save results
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        st.session_state.research_results[timestamp] = {
+        research_id = _new_research_id()
+        record = {
             "topic": topic,
             "focus_areas": focus_areas,
             "results": results
         }
-        save_results()
+        st.session_state.research_index[research_id] = topic
+        # Write to disk in the background so the results show up right away
+        saving = _get_io_pool().submit(save_result, research_id, record)
+        _remember_result(research_id, record, saving)
         
         # Immediately show the results by updating the view
         st.session_state.current_view = "view_research"
-        st.session_state.selected_research = timestamp
+        st.session_state.selected_research = research_id
         
         # Force a rerun to update the sidebar and show the new research
         st.rerun()
@@ -166,87 +498,74 @@ def conduct_research(topic, focus_areas):
 if not hasattr(st.session_state, 'current_view'):
     st.session_state.current_view = "new_research"
 
-if st.session_state.current_view == "new_research":
-    st.header("New Research")
-    
-    with st.form("research_form"):
-        topic = st.text_input("Research Topic")
-        focus_areas = st.text_area("Focus Areas (comma-separated)")
-        submitted = st.form_submit_button("Start Research")
-        
-        if submitted:
-            if not st.session_state.api_key:
-                st.error("Please enter your OpenAI API key in the sidebar first!")
-            elif topic and focus_areas:
-                success, message = conduct_research(topic, focus_areas)
-                if success:
-                    st.success(message)
-                else:
-                    st.error(message)
-
-# View Research Results
-elif st.session_state.current_view == "view_research":
-    if hasattr(st.session_state, 'selected_research'):
-        research = st.session_state.research_results[st.session_state.selected_research]
-        st.header(f"Research Results: {research['topic']}")
-        st.subheader("Focus Areas")
-        st.write(research['focus_areas'])
+@st.fragment
+def _main_content():
+    """Render the research form or the selected results
+
+    Running as a fragment means interactions in here only rerun this
+    function, not the header, sidebar and footer around it.
+    """
+    if st.session_state.current_view == "new_research":
+        st.header("New Research")
         
-        st.subheader("Results")
-        # Display results in an expandable container to handle long content
-        with st.expander("View Full Results", expanded=True):
-            st.json(research['results'])
+        with st.form("research_form"):
+            topic = st.text_input("Research Topic")
+            focus_areas = st.text_area("Focus Areas (comma-separated)")
+            submitted = st.form_submit_button("Start Research")
+            
+            if submitted:
+                if not st.session_state.api_key:
+                    st.error("Please enter your OpenAI API key in the sidebar first!")
+                elif topic and focus_areas:
+                    success, message = conduct_research(topic, focus_areas)
+                    if success:
+                        st.success(message)
+                    else:
+                        st.error(message)
+
+    # View Research Results
+    elif st.session_state.current_view == "view_research":
+        research = None
+        if hasattr(st.session_state, 'selected_research'):
+            research = _get_result(st.session_state.selected_research)
+            if research is None:
+                st.error("These research results are no longer available.")
         
-        # Export options
-        if st.button("Export as Markdown"):
-            def dict_to_markdown(d, level=0):
-                md = ""
-                indent = "  " * level
-                
-                if isinstance(d, dict):
-                    for key, value in d.items():
-                        if isinstance(value, (dict, list)):
-                            md += f"{indent}### {key}\n\n"
-                            md += dict_to_markdown(value, level + 1)
-                        else:
-                            # Check if value is a string containing markdown
-                            if isinstance(value, str) and any(marker in value for marker in ['###', '##', '#', '**', '-']):
-                                md += f"{indent}### {key}\n\n{value}\n\n"
-                            else:
-                                md += f"{indent}### {key}\n\n```\n{value}\n```\n\n"
-                elif isinstance(d, list):
-                    for item in d:
-                        if isinstance(item, (dict, list)):
-                            md += dict_to_markdown(item, level)
-                        else:
-                            md += f"{indent}- {item}\n"
-                    md += "\n"
-                else:
-                    md += f"{indent}{d}\n\n"
-                return md
+        if research is not None:
+            st.header(f"Research Results: {research['topic']}")
+            st.subheader("Focus Areas")
+            st.write(research['focus_areas'])
             
-            # Create markdown content
-            md_content = f"# Research Results: {research['topic']}\n\n"
-            md_content += f"## Focus Areas\n{research['focus_areas']}\n\n"
-            md_content += "## Results\n\n"
-            md_content += dict_to_markdown(research['results'])
+            st.subheader("Results")
+            # Display results in an expandable container to handle long content
+            with st.expander("View Full Results", expanded=True):
+                results = research['results']
+                if isinstance(results, dict) and results:
+                    # Only send the selected top-level section to the browser
+                    section = st.selectbox("Section", list(results))
+                    value = results[section]
+                    if isinstance(value, (dict, list)):
+                        st.json(value)
+                    else:
+                        st.write(value)
+                else:
+                    st.json(results)
             
-            # Create download button
-            st.download_button(
-                label="Download Markdown",
-                data=md_content,
-                file_name=f"research_{research['topic'].lower().replace(' ', '_')}.md",
-                mime="text/markdown"
-            )
+            # Export options
+            if st.button("Export as Markdown"):
+                # Create markdown content
+                md_content = _export_markdown(st.session_state.selected_research, research)
+                
+                # Create download button
+                st.download_button(
+                    label="Download Markdown",
+                    data=md_content,
+                    file_name=f"research_{research['topic'].casefold().translate(_SLUG_TABLE)}.md",
+                    mime="text/markdown"
+                )
+
+_main_content()
 
 # Footer
 st.markdown("---")
-st.markdown("""
-    <div class="company-info" style="text-align: center;">
-        <p>© 2024 AI Engineering. All rights reserved.</p>
-        <p>
-            <a href="https://ai-engineering.ai" target="_blank">Visit our website</a> | 
-            <a href="mailto:dirk.wonhoefer@ai-engineering.ai">Contact us</a>
-        </p>
-    </div>
-""", unsafe_allow_html=True) 
\ No newline at end of file
+st.markdown(_FOOTER_HTML, unsafe_allow_html=True) 
\ No newline at end of file